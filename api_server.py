@@ -3,22 +3,33 @@ FastAPI backend for CLIP Neuron Visualizer web interface.
 This server provides API endpoints for layer information, neuron names, and image generation.
 
 Installation:
-    pip install fastapi uvicorn python-multipart
+    pip install fastapi uvicorn
 
 Usage:
     uvicorn api_server:app --reload --host 0.0.0.0 --port 8000
 """
 
+import os
+
+# Batches of different sizes fragment the caching allocator; must be set before torch loads
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:128")
+
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import asyncio
+import base64
 import torch
 import clip
-from io import BytesIO
-from typing import Optional
+from functools import lru_cache
+from typing import List, Literal, Optional
 
 from layer_inspector import LayerInspector
-from feature_visualizer import FeatureVisualizer
+from feature_visualizer import FeatureVisualizer, default_precision, freeze_model, offload_text_encoder, empty_cache_if_low
+from image_encoder import encode_image_fast, MEDIA_TYPES
+from result_cache import ResultCache, generation_key
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -41,11 +52,53 @@ model = None
 device = None
 inspector = None
 visualizer = None
+result_cache = ResultCache()
+
+# Layers offered to clients, computed once when the model loads
+INTERESTING_LAYERS = ()
+
+# The shared visualizer holds one set of targets, images and optimizer state,
+# and concurrent jobs on one GPU would only compete for the same SMs, so
+# generation requests run one at a time.
+GPU_LOCK = asyncio.Lock()
+
+# Upper bound on images optimized together by /api/generate_batch
+MAX_BATCH_TARGETS = 32
+
+
+class NeuronTarget(BaseModel):
+    """A single (layer, neuron) pair to visualize."""
+    layer: str
+    neuron: int = Field(ge=0)
+
+
+class GenerationSettings(BaseModel):
+    """Optimization settings shared by the generation endpoints."""
+    image_size: Literal[224] = 224
+    num_iterations: int = Field(1000, ge=100, le=5000)
+    learning_rate: float = Field(0.01, gt=0)
+    blur_every: int = Field(10, ge=1)
+    seed: int = 42
+    precision: Optional[Literal["fp32", "fp16", "bf16"]] = None
+    optimizer: Literal["adam", "sgd", "sgd_nomom"] = "adam"
+    parameterization: Literal["pixel", "fourier"] = "pixel"
+
+
+class GenParams(GenerationSettings):
+    """Request body for /api/generate."""
+    layer_name: str
+    neuron_index: int = Field(ge=0)
+    format: Literal["png", "raw"] = "png"
+
+
+class BatchGenParams(GenerationSettings):
+    """Request body for /api/generate_batch."""
+    targets: List[NeuronTarget] = Field(min_length=1, max_length=MAX_BATCH_TARGETS)
 
 
 def initialize_models():
     """Initialize CLIP model and utilities."""
-    global model, device, inspector, visualizer
+    global model, device, inspector, visualizer, INTERESTING_LAYERS
     
     if model is not None:
         return
@@ -55,12 +108,52 @@ def initialize_models():
     print(f"Using device: {device}")
     
     model, _ = clip.load("ViT-B/32", device=device)
+    model = freeze_model(offload_text_encoder(model))
     inspector = LayerInspector(model, model_name="ViT-B/32")
-    visualizer = FeatureVisualizer(model, device=device)
+    INTERESTING_LAYERS = tuple(inspector.get_interesting_layer_names())
+    visualizer = FeatureVisualizer(
+        model, device=device, compile_visual=device == "cuda", inspector=inspector
+    )
+    
+    # Layer metadata caches are only valid for the model they were built from
+    cached_neuron_names.cache_clear()
+    cached_layer_info.cache_clear()
     
     print("✓ Models loaded!")
 
 
+def check_layer(layer: str):
+    """Reject unknown layers before they reach the metadata caches."""
+    # The caches are keyed on the client's query string, so only real layers may enter them
+    if layer not in inspector.layers_info:
+        raise ValueError(f"Unknown layer '{layer}'")
+
+
+@lru_cache(maxsize=None)
+def cached_neuron_names(layer: str) -> tuple:
+    """Neuron names for a layer; the model is frozen so these never change."""
+    return tuple(inspector.get_neuron_names(layer))
+
+
+@lru_cache(maxsize=None)
+def cached_layer_info(layer: str) -> dict:
+    """Layer information for a layer; the model is frozen so this never changes."""
+    return inspector.get_layer_info(layer)
+
+
+def run_on_gpu(func, **kwargs):
+    """Run a visualizer method on a dedicated CUDA stream (worker thread)."""
+    if device != "cuda":
+        return func(**kwargs)
+    
+    stream = torch.cuda.Stream()
+    with torch.cuda.stream(stream):
+        result = func(**kwargs)
+    stream.synchronize()
+    empty_cache_if_low()
+    return result
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize models on startup."""
@@ -82,20 +175,10 @@ async def get_layers():
     """Get list of available layers."""
     try:
         initialize_models()
-        layers = inspector.get_layer_names()
-        
-        # Filter to interesting layers
-        interesting_layers = [
-            l for l in layers
-            if any(x in l for x in ['transformer', 'attn', 'mlp', 'ln', 'proj'])
-        ]
-        
-        if not interesting_layers:
-            interesting_layers = layers
         
         return {
-            "layers": interesting_layers,
-            "total": len(layers)
+            "layers": INTERESTING_LAYERS,
+            "total": len(inspector.layers_info)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -106,7 +189,8 @@ async def get_neurons(layer: str):
     """Get available neurons for a layer."""
     try:
         initialize_models()
-        neurons = inspector.get_neuron_names(layer)
+        check_layer(layer)
+        neurons = cached_neuron_names(layer)
         return {
             "layer": layer,
             "neurons": neurons,
@@ -121,56 +205,79 @@ async def get_layer_info(layer: str):
     """Get information about a specific layer."""
     try:
         initialize_models()
-        info = inspector.get_layer_info(layer)
-        return info
+        check_layer(layer)
+        info = cached_layer_info(layer)
+        return dict(info)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid layer: {str(e)}")
 
 
 @app.post("/api/generate")
-async def generate_visualization(
-    layer_name: str,
-    neuron_index: int,
-    image_size: int = 224,
-    num_iterations: int = 1000,
-    learning_rate: float = 0.01,
-    blur_every: int = 10,
-    seed: int = 42
-):
-    """Generate a neuron visualization."""
+async def generate_visualization(params: GenParams):
+    """Generate a neuron visualization.
+
+    Set ``format`` to ``raw`` to receive the packed pixel buffer instead of a PNG;
+    its dimensions and mode are returned in the X-Image-* headers.
+    """
     try:
         initialize_models()
         
-        # Validate inputs
-        if image_size < 64 or image_size > 512:
-            raise ValueError("image_size must be between 64 and 512")
+        # Generation is deterministic for a fixed seed, so identical requests hit the disk cache
+        extension = "png" if params.format == "png" else "bin"
+        settings = params.model_dump()
+        # Resolve the default precision so explicit and implicit requests share entries
+        settings["precision"] = params.precision or default_precision(device)
+        key = generation_key(**settings, model="ViT-B/32", device=device)
+        headers = {
+            "Content-Disposition": f"attachment; filename=neuron_{params.neuron_index}.{extension}",
+            "X-Image-Width": str(params.image_size),
+            "X-Image-Height": str(params.image_size),
+            "X-Image-Mode": "RGB",
+        }
         
-        if num_iterations < 100 or num_iterations > 5000:
-            raise ValueError("num_iterations must be between 100 and 5000")
+        cached = result_cache.get(key, extension)
+        if cached is not None:
+            return StreamingResponse(
+                iter([cached]),
+                media_type=MEDIA_TYPES[params.format],
+                headers={**headers, "X-Cache": "HIT"}
+            )
         
         # Generate image
-        print(f"Generating: layer={layer_name}, neuron={neuron_index}")
+        print(f"Generating: layer={params.layer_name}, neuron={params.neuron_index}")
         
-        generated_image = visualizer.generate_image(
-            layer_name=layer_name,
-            neuron_index=neuron_index,
-            image_size=image_size,
-            num_iterations=num_iterations,
-            learning_rate=learning_rate,
-            blur_every=blur_every,
-            seed=seed
-        )
+        # Run off the event loop so /health and metadata endpoints stay responsive
+        async with GPU_LOCK:
+            generated_image = await run_in_threadpool(
+                run_on_gpu,
+                visualizer.generate_image,
+                layer_name=params.layer_name,
+                neuron_index=params.neuron_index,
+                image_size=params.image_size,
+                num_iterations=params.num_iterations,
+                learning_rate=params.learning_rate,
+                blur_every=params.blur_every,
+                seed=params.seed,
+                precision=params.precision,
+                optimizer=params.optimizer,
+                parameterization=params.parameterization
+            )
         
-        # Convert to PNG bytes
-        img_byte_arr = BytesIO()
-        generated_image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+        # Encode in a single pass and send as one chunk
+        data = encode_image_fast(generated_image, params.format)
+        result_cache.put(key, data, extension)
         
         # Return image
         return StreamingResponse(
-            img_byte_arr,
-            media_type="image/png",
-            headers={"Content-Disposition": f"attachment; filename=neuron_{neuron_index}.png"}
+            iter([data]),
+            media_type=MEDIA_TYPES[params.format],
+            headers={
+                **headers,
+                "X-Image-Width": str(generated_image.width),
+                "X-Image-Height": str(generated_image.height),
+                "X-Image-Mode": generated_image.mode,
+                "X-Cache": "MISS",
+            }
         )
     
     except Exception as e:
@@ -178,6 +285,45 @@ async def generate_visualization(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/generate_batch")
+async def generate_batch_visualization(params: BatchGenParams):
+    """Generate visualizations for several neurons in one batched optimization."""
+    try:
+        initialize_models()
+        
+        print(f"Generating batch of {len(params.targets)} neurons")
+        
+        async with GPU_LOCK:
+            images = await run_in_threadpool(
+                run_on_gpu,
+                visualizer.generate_images,
+                targets=[(t.layer, t.neuron) for t in params.targets],
+                image_size=params.image_size,
+                num_iterations=params.num_iterations,
+                learning_rate=params.learning_rate,
+                blur_every=params.blur_every,
+                seeds=[params.seed] * len(params.targets),
+                precision=params.precision,
+                optimizer=params.optimizer,
+                parameterization=params.parameterization
+            )
+        
+        return {
+            "images": [
+                {
+                    "layer": target.layer,
+                    "neuron": target.neuron,
+                    "image": base64.b64encode(encode_image_fast(image, "png")).decode("ascii")
+                }
+                for target, image in zip(params.targets, images)
+            ]
+        }
+    
+    except Exception as e:
+        print(f"Error generating batch visualization: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API documentation."""
@@ -189,7 +335,8 @@ async def root():
             "layers": "/api/layers",
             "neurons": "/api/neurons?layer=<layer_name>",
             "layer_info": "/api/layer-info?layer=<layer_name>",
-            "generate": "/api/generate (POST)"
+            "generate": "/api/generate (POST)",
+            "generate_batch": "/api/generate_batch (POST)"
         },
         "docs": "/docs"
     }
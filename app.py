@@ -2,35 +2,70 @@
 Main interactive Streamlit application for CLIP neuron visualization.
 """
 
+import os
+
+# Batches of different sizes fragment the caching allocator; must be set before torch loads
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:128")
+
 import streamlit as st
 import torch
 import clip
 from pathlib import Path
 from datetime import datetime
-import os
+import gc
+import threading
 
 from layer_inspector import LayerInspector
-from feature_visualizer import FeatureVisualizer
+from feature_visualizer import FeatureVisualizer, default_precision, freeze_model, offload_text_encoder, empty_cache_if_low, IMAGE_SIZES, OPTIMIZERS, PARAMETERIZATIONS, PRECISIONS
+from image_encoder import encode_image_fast
+from result_cache import ResultCache, generation_key
 
 
 @st.cache_resource
 def load_clip_model():
-    """Load CLIP model with caching."""
+    """
+    Load CLIP and the helpers built on it, once per process.
+    
+    Every session shares the same model, inspector and visualizer, so opening
+    more tabs never puts another copy of the model on the GPU.
+    """
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model, preprocess = clip.load("ViT-B/32", device=device)
-    return model, device
+    model = freeze_model(offload_text_encoder(model))
+    inspector = LayerInspector(model, model_name="ViT-B/32")
+    visualizer = FeatureVisualizer(
+        model,
+        device=device,
+        compile_visual=device == "cuda",
+        inspector=inspector
+    )
+    return model, device, inspector, visualizer
 
 
 @st.cache_resource
-def get_layer_inspector(model):
-    """Get layer inspector with caching."""
-    return LayerInspector(model, model_name="ViT-B/32")
+def get_generation_lock():
+    """
+    Process-wide lock around the shared visualizer.
+    
+    The visualizer holds per-run state, so generations run one at a time,
+    and the model is only released while no generation is running.
+    """
+    return threading.Lock()
 
 
-@st.cache_resource
-def get_feature_visualizer(model, device):
-    """Get feature visualizer with caching."""
-    return FeatureVisualizer(model, device=device)
+def release_gpu():
+    """Unload the shared model for every session and return its GPU memory."""
+    with get_generation_lock():
+        load_clip_model.clear()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+@st.cache_data
+def get_interesting_layers(_inspector):
+    """Get the filtered layer list, computed once for the cached model."""
+    return _inspector.get_interesting_layer_names()
 
 
 def main():
@@ -49,26 +84,22 @@ def main():
     
     # Load model
     st.sidebar.header("Model Configuration")
+    if st.sidebar.button("🧹 Release GPU", use_container_width=True):
+        release_gpu()
+        st.sidebar.info("Model unloaded. Change any setting to load it again.")
+        st.stop()
+    
     with st.spinner("Loading CLIP model..."):
-        model, device = load_clip_model()
-        inspector = get_layer_inspector(model)
-        visualizer = get_feature_visualizer(model, device)
+        model, device, inspector, visualizer = load_clip_model()
     
     st.sidebar.success("✓ CLIP model loaded!")
     st.sidebar.write(f"Device: {device.upper()}")
     
     # Layer selection
     st.sidebar.header("Layer Selection")
-    layer_names = inspector.get_layer_names()
     
     # Filter to interesting layers (exclude very small ones)
-    interesting_layers = [
-        l for l in layer_names 
-        if any(x in l for x in ['transformer', 'attn', 'mlp', 'ln', 'proj'])
-    ]
-    
-    if not interesting_layers:
-        interesting_layers = layer_names
+    interesting_layers = get_interesting_layers(inspector)
     
     selected_layer = st.sidebar.selectbox(
         "Select Layer",
@@ -111,13 +142,10 @@ def main():
     
     col1, col2 = st.sidebar.columns(2)
     with col1:
-        image_size = st.number_input(
+        image_size = st.selectbox(
             "Image Size",
-            min_value=64,
-            max_value=512,
-            value=224,
-            step=32,
-            help="Resolution of generated image"
+            IMAGE_SIZES,
+            help="Resolution of generated image (fixed by CLIP's positional embedding)"
         )
     
     with col2:
@@ -156,6 +184,25 @@ def main():
         help="Set for reproducible results"
     )
     
+    precision = st.sidebar.selectbox(
+        "Precision",
+        list(PRECISIONS),
+        index=list(PRECISIONS).index(default_precision(device)),
+        help="Numeric precision of the CLIP forward pass (GPU only; CPU always uses fp32)"
+    )
+    
+    optimizer_name = st.sidebar.selectbox(
+        "Optimizer",
+        list(OPTIMIZERS),
+        help="Adam gives the best single images; SGD variants use less memory"
+    )
+    
+    parameterization = st.sidebar.selectbox(
+        "Parameterization",
+        list(PARAMETERIZATIONS),
+        help="Fourier optimizes a 1/f-scaled spectrum: smoother images in fewer iterations"
+    )
+    
     # Generate button
     st.sidebar.header("Generation")
     generate_btn = st.sidebar.button(
@@ -195,7 +242,9 @@ def main():
             # Generate image
             st.write("Generating image (this may take a few minutes)...")
             
-            generated_image = visualizer.generate_image(
+            # Same key as /api/generate, so the app and the API share results
+            cache = ResultCache()
+            cache_key = generation_key(
                 layer_name=selected_layer,
                 neuron_index=selected_neuron_idx,
                 image_size=image_size,
@@ -203,34 +252,74 @@ def main():
                 learning_rate=learning_rate,
                 blur_every=blur_every,
                 seed=seed_value,
-                progress_callback=update_progress
+                precision=precision,
+                optimizer=optimizer_name,
+                parameterization=parameterization,
+                format="png",
+                model="ViT-B/32",
+                device=device,
             )
+            cached = cache.get(cache_key)
+            
+            if cached is not None:
+                png_bytes = cached
+                progress_bar.progress(1.0)
+                status_text.text("Loaded from cache")
+            else:
+                # The visualizer is shared by all sessions, one run at a time
+                with get_generation_lock():
+                    generated_image = visualizer.generate_image(
+                        layer_name=selected_layer,
+                        neuron_index=selected_neuron_idx,
+                        image_size=image_size,
+                        num_iterations=num_iterations,
+                        learning_rate=learning_rate,
+                        blur_every=blur_every,
+                        seed=seed_value,
+                        progress_callback=update_progress,
+                        precision=precision,
+                        optimizer=optimizer_name,
+                        parameterization=parameterization
+                    )
+                empty_cache_if_low()
+                
+                # Encode once; the same PNG bytes are displayed, cached and saved
+                png_bytes = encode_image_fast(generated_image, "png")
+                cache.put(cache_key, png_bytes)
             
             # Display results
             with col1:
-                st.image(generated_image, use_column_width=True)
+                st.image(png_bytes, use_column_width=True)
             
-            # Save option
-            st.sidebar.header("Export")
-            if st.sidebar.button("💾 Save Image", use_container_width=True):
-                # Create output directory
-                output_dir = Path("generated_images")
-                output_dir.mkdir(exist_ok=True)
-                
-                # Generate filename
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"neuron_{selected_neuron_idx}_{selected_layer.replace('.', '_')}_{timestamp}.png"
-                filepath = output_dir / filename
-                
-                # Save image
-                generated_image.save(filepath)
-                st.success(f"✓ Image saved to {filepath}")
-                st.sidebar.write(f"Saved: {filename}")
+            # Kept across reruns: clicking Save reruns the script without generate_btn
+            st.session_state["last_image"] = {
+                "png_bytes": png_bytes,
+                "stem": f"neuron_{selected_neuron_idx}_{selected_layer.replace('.', '_')}",
+            }
         
         except Exception as e:
             st.error(f"❌ Error during generation: {str(e)}")
             st.write("Please check the parameters and try again.")
     
+    # Save option for the most recent image of this session
+    last_image = st.session_state.get("last_image")
+    if last_image is not None:
+        st.sidebar.header("Export")
+        if st.sidebar.button("💾 Save Image", use_container_width=True):
+            # Create output directory
+            output_dir = Path("generated_images")
+            output_dir.mkdir(exist_ok=True)
+            
+            # Generate filename
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{last_image['stem']}_{timestamp}.png"
+            filepath = output_dir / filename
+            
+            # Save the PNG bytes encoded at generation time
+            filepath.write_bytes(last_image["png_bytes"])
+            st.success(f"✓ Image saved to {filepath}")
+            st.sidebar.write(f"Saved: {filename}")
+    
     # Information section
     with st.expander("ℹ️ About"):
         st.markdown("""
@@ -245,7 +334,7 @@ def main():
         4. The result is a synthetic image that reveals what features the neuron responds to
         
         **Parameters:**
-        - **Image Size**: Resolution of the generated image (larger = slower but possibly more detailed)
+        - **Image Size**: Resolution of the generated image (224, fixed by CLIP ViT-B/32)
         - **Iterations**: Number of optimization steps (more = better but slower)
         - **Learning Rate**: How quickly the optimization proceeds
         - **Blur Every N Iterations**: Periodically smooths the image for more natural results
@@ -10,11 +10,12 @@ Usage examples:
 import argparse
 import torch
 import clip
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 import json
 from layer_inspector import LayerInspector
-from feature_visualizer import FeatureVisualizer
+from feature_visualizer import FeatureVisualizer, offload_text_encoder, IMAGE_SIZES, OPTIMIZERS
 
 
 def batch_generate(
@@ -26,7 +27,9 @@ def batch_generate(
     learning_rate: float = 0.01,
     blur_every: int = 10,
     seed_base: int = 42,
-    skip_existing: bool = True
+    skip_existing: bool = True,
+    batch_size: int = None,
+    optimizer: str = "sgd_nomom"
 ):
     """
     Generate visualizations for multiple neurons.
@@ -41,6 +44,9 @@ def batch_generate(
         blur_every: Apply blur every N iterations
         seed_base: Base seed (will be offset by neuron index)
         skip_existing: Skip neurons that already have visualizations
+        batch_size: Number of neurons optimized together in one forward/backward pass
+            (None picks the largest batch that fits in free GPU memory)
+        optimizer: Image optimizer ('sgd_nomom' keeps no per-pixel state, saving memory)
     """
     
     # Setup
@@ -51,10 +57,12 @@ def batch_generate(
     # Load model
     print("Loading CLIP model...")
     model, _ = clip.load("ViT-B/32", device=device)
+    model = offload_text_encoder(model)
     
     # Setup inspector and visualizer
     inspector = LayerInspector(model)
-    visualizer = FeatureVisualizer(model, device=device)
+    # The sweep repeats one fixed-shape step, so replay it as a CUDA graph
+    visualizer = FeatureVisualizer(model, device=device, cuda_graph=device == "cuda", inspector=inspector)
     
     # Validate layer
     if layer_name not in inspector.get_layer_names():
@@ -82,12 +90,15 @@ def batch_generate(
             "iterations": iterations,
             "learning_rate": learning_rate,
             "blur_every": blur_every,
+            "batch_size": batch_size,
+            "optimizer": optimizer,
         },
         "neurons": {}
     }
     
-    # Generate visualizations
+    # Collect neurons that still need to be generated
     print("\n" + "=" * 60)
+    pending = []
     for i, neuron_idx in enumerate(neuron_indices):
         if neuron_idx >= len(neuron_names):
             print(f"⚠️  Neuron {neuron_idx} out of range, skipping")
@@ -108,47 +119,82 @@ def batch_generate(
             }
             continue
         
-        print(f"[{i+1}/{len(neuron_indices)}] Generating neuron {neuron_idx} ({neuron_name})...")
-        
-        # Progress callback
-        def progress(current, total, activation):
-            percent = (current / total) * 100
-            bar_length = 30
-            filled = int(bar_length * current / total)
-            bar = "█" * filled + "░" * (bar_length - filled)
-            print(f"  [{bar}] {percent:.0f}% Activation: {activation:.4f}", end='\r')
+        pending.append((neuron_idx, neuron_name, filename, filepath))
+    
+    # Progress callback
+    def progress(current, total, activation):
+        percent = (current / total) * 100
+        bar_length = 30
+        filled = int(bar_length * current / total)
+        bar = "█" * filled + "░" * (bar_length - filled)
+        print(f"  [{bar}] {percent:.0f}% Activation: {activation:.4f}", end='\r')
+    
+    # Image buffers, optimizer state and hooks persist across chunks
+    visualizer.configure(
+        image_size=image_size,
+        learning_rate=learning_rate,
+        blur_every=blur_every,
+        optimizer=optimizer
+    )
+    
+    if batch_size is None:
+        batch_size = visualizer.suggest_batch_size(layer_name)
+        metadata["parameters"]["batch_size"] = batch_size
+        print(f"📦 Batch size: {batch_size} neurons per pass")
+    
+    # PNG encoding and disk writes overlap with the next chunk's GPU work
+    save_pool = ThreadPoolExecutor(max_workers=2)
+    saves = []
+    
+    # Generate visualizations, batch_size neurons per optimization
+    for chunk_start in range(0, len(pending), batch_size):
+        chunk = pending[chunk_start:chunk_start + batch_size]
+        chunk_indices = [neuron_idx for neuron_idx, _, _, _ in chunk]
+        print(f"[{chunk_start + len(chunk)}/{len(pending)}] Generating neurons {chunk_indices}...")
         
         try:
-            # Generate image
-            image = visualizer.generate_image(
-                layer_name=layer_name,
-                neuron_index=neuron_idx,
-                image_size=image_size,
-                num_iterations=iterations,
-                learning_rate=learning_rate,
-                blur_every=blur_every,
-                seed=seed_base + neuron_idx,
-                progress_callback=progress
-            )
+            # Generate images
+            visualizer.set_targets([(layer_name, neuron_idx) for neuron_idx in chunk_indices])
+            visualizer.reset_image([seed_base + neuron_idx for neuron_idx in chunk_indices])
+            
+            visualizer.run(iterations, progress_callback=progress)
             
-            # Save image
-            image.save(filepath)
-            print(f"\n  ✓ Saved to {filename}")
+            images = visualizer.get_images()
+            print()
             
-            # Update metadata
+            for (neuron_idx, neuron_name, filename, filepath), image in zip(chunk, images):
+                # Save image in the background
+                saves.append((save_pool.submit(image.save, filepath), neuron_idx, neuron_name, filename))
+        
+        except Exception as e:
+            print(f"\n  ❌ Error generating neurons {chunk_indices}: {str(e)}")
+            for neuron_idx, neuron_name, _, _ in chunk:
+                metadata["neurons"][neuron_idx] = {
+                    "name": neuron_name,
+                    "status": "error",
+                    "error": str(e)
+                }
+    
+    visualizer.clear_targets()
+    
+    # Wait for the pending saves and update metadata
+    for future, neuron_idx, neuron_name, filename in saves:
+        try:
+            future.result()
+            print(f"  ✓ Saved to {filename}")
             metadata["neurons"][neuron_idx] = {
                 "name": neuron_name,
                 "status": "success",
                 "file": filename
             }
-        
         except Exception as e:
-            print(f"\n  ❌ Error generating neuron {neuron_idx}: {str(e)}")
+            print(f"  ❌ Error saving neuron {neuron_idx}: {str(e)}")
             metadata["neurons"][neuron_idx] = {
                 "name": neuron_name,
                 "status": "error",
                 "error": str(e)
             }
+    save_pool.shutdown()
     
     # Save metadata
     metadata["end_time"] = datetime.now().isoformat()
@@ -193,8 +239,9 @@ def main():
     parser.add_argument(
         "--size",
         type=int,
+        choices=IMAGE_SIZES,
         default=224,
-        help="Image size (default: 224)"
+        help="Image size (default: 224, the only size ViT-B/32 accepts)"
     )
     
     parser.add_argument(
@@ -225,6 +272,20 @@ def main():
         help="Base seed for reproducibility (default: 42)"
     )
     
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Neurons optimized together per pass (default: as many as fit in GPU memory)"
+    )
+    
+    parser.add_argument(
+        "--optimizer",
+        choices=OPTIMIZERS,
+        default="sgd_nomom",
+        help="Image optimizer (default: sgd_nomom, lowest memory for sweeps)"
+    )
+    
     parser.add_argument(
         "--no-skip",
         action="store_true",
@@ -243,7 +304,9 @@ def main():
         learning_rate=args.lr,
         blur_every=args.blur_every,
         seed_base=args.seed_base,
-        skip_existing=not args.no_skip
+        skip_existing=not args.no_skip,
+        batch_size=args.batch_size,
+        optimizer=args.optimizer
     )
 
 
@@ -8,7 +8,7 @@ import torch
 import clip
 from pathlib import Path
 from layer_inspector import LayerInspector
-from feature_visualizer import FeatureVisualizer
+from feature_visualizer import FeatureVisualizer, offload_text_encoder, IMAGE_SIZES, OPTIMIZERS, PARAMETERIZATIONS
 
 
 def main():
@@ -50,8 +50,9 @@ def main():
     parser.add_argument(
         "--size",
         type=int,
+        choices=IMAGE_SIZES,
         default=224,
-        help="Image size (default: 224)"
+        help="Image size (default: 224, the only size ViT-B/32 accepts)"
     )
     
     parser.add_argument(
@@ -82,12 +83,27 @@ def main():
         help="Random seed (default: 42)"
     )
     
+    parser.add_argument(
+        "--optimizer",
+        choices=OPTIMIZERS,
+        default="adam",
+        help="Image optimizer (default: adam)"
+    )
+    
+    parser.add_argument(
+        "--parameterization",
+        choices=PARAMETERIZATIONS,
+        default="pixel",
+        help="Optimize raw pixels or a 1/f-scaled Fourier spectrum (default: pixel)"
+    )
+    
     args = parser.parse_args()
     
     # Load model
     print("Loading CLIP model...")
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model, preprocess = clip.load("ViT-B/32", device=device)
+    model = offload_text_encoder(model)
     print(f"✓ Model loaded on {device.upper()}")
     
     # Initialize inspector
@@ -137,7 +153,8 @@ def main():
     
     # Initialize visualizer
     print("\nInitializing visualizer...")
-    visualizer = FeatureVisualizer(model, device=device)
+    # Every iteration runs the same fixed-shape step, so replay it as a CUDA graph
+    visualizer = FeatureVisualizer(model, device=device, cuda_graph=device == "cuda", inspector=inspector)
     
     # Generate image
     print(f"\n🎨 Generating visualization...")
@@ -146,6 +163,8 @@ def main():
     print(f"  Size: {args.size}x{args.size}")
     print(f"  Iterations: {args.iterations}")
     print(f"  Learning Rate: {args.lr}")
+    print(f"  Optimizer: {args.optimizer}")
+    print(f"  Parameterization: {args.parameterization}")
     
     def progress_callback(current, total, activation):
         percent = (current / total) * 100
@@ -163,7 +182,9 @@ def main():
             learning_rate=args.lr,
             blur_every=args.blur_every,
             seed=args.seed,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            optimizer=args.optimizer,
+            parameterization=args.parameterization
         )
         
         # Create output directory if needed
@@ -2,177 +2,870 @@
 Feature visualization module for generating images that maximize neuron activations.
 """
 
+import contextlib
+import time
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 from PIL import Image
-import torchvision.transforms as transforms
 from tqdm import tqdm
-from typing import Callable, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+
+# Supported precisions for the CLIP forward pass (CPU always runs FP32)
+PRECISIONS = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+# CLIP's image normalization stats
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+# Input sizes the visual encoder accepts; ViT-B/32's positional embedding
+# is fixed to a 7x7 grid of 32px patches
+IMAGE_SIZES = (224,)
+
+
+# Optimizers for the image parameters; plain SGD keeps no per-pixel state
+OPTIMIZERS = ("adam", "sgd", "sgd_nomom")
+
+
+# Normalized pixel values are clamped to [-PIXEL_RANGE, PIXEL_RANGE] after each update
+PIXEL_RANGE = 2.0
+
+# How the optimized image is represented: raw pixels, or a 1/f-scaled spectrum
+PARAMETERIZATIONS = ("pixel", "fourier")
+
+# Std of the initial Fourier coefficients (starts close to a flat gray image)
+FOURIER_INIT_STD = 0.01
+
+
+# Batch size suggested when there is no GPU memory to measure
+DEFAULT_CPU_BATCH_SIZE = 8
+
+# Weight of the total variation penalty in the loss
+DEFAULT_TV_WEIGHT = 0.01
+
+# Extra compiled graphs allowed beyond one per layer (multi-layer batches)
+COMPILE_RECOMPILE_MARGIN = 32
+
+# Eager steps run before capturing the optimization step as a CUDA graph
+CUDA_GRAPH_WARMUP_STEPS = 3
+
+
+def gaussian_kernel_1d(kernel_size: int = 3, sigma: float = 1.0) -> torch.Tensor:
+    """Build a normalized 1-D Gaussian kernel."""
+    coords = torch.arange(kernel_size, dtype=torch.float32) - kernel_size // 2
+    kernel = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    return kernel / kernel.sum()
+
+
+def default_precision(device: str) -> str:
+    """
+    Forward precision used when none is requested.
+    
+    BF16 keeps FP32's exponent range, so activations can't overflow the way
+    they can in FP16; it is preferred on GPUs with native BF16 (Ampere+).
+    Older GPUs only emulate it, which is slower than FP32, so they get FP16.
+    """
+    device = torch.device(device)
+    if device.type != "cuda":
+        return "fp32"
+    major, _ = torch.cuda.get_device_capability(device)
+    return "bf16" if major >= 8 else "fp16"
+
+
+def fourier_scale(height: int, width: int, decay_power: float = 1.0) -> torch.Tensor:
+    """
+    Per-frequency scale for a 1/f image spectrum, as used with torch.fft.irfft2.
+    
+    Returns:
+        Tensor of shape (H, W // 2 + 1)
+    """
+    fy = torch.fft.fftfreq(height)[:, None]
+    fx = torch.fft.rfftfreq(width)[None, :]
+    freqs = torch.sqrt(fx ** 2 + fy ** 2)
+    
+    # Clamp the DC term so it keeps a finite scale
+    scale = 1.0 / freqs.clamp(min=1.0 / max(height, width)) ** decay_power
+    return scale * (height * width) ** 0.5
+
+
+def freeze_model(model: nn.Module) -> nn.Module:
+    """
+    Put a model in eval mode and stop autograd from tracking its parameters.
+    
+    Only the optimized image needs gradients, so frozen parameters keep
+    backward from saving activations for weight gradients we never use.
+    """
+    for param in model.parameters():
+        param.requires_grad_(False)
+    return model.eval()
+
+
+def offload_text_encoder(model: nn.Module) -> nn.Module:
+    """
+    Move CLIP's text tower to the CPU.
+    
+    Visualization only runs model.visual, so the text transformer,
+    embeddings and projection would otherwise sit idle in GPU memory.
+    """
+    for module in (model.transformer, model.token_embedding, model.ln_final):
+        module.to("cpu")
+    
+    for param in (model.positional_embedding, model.text_projection):
+        param.data = param.data.cpu()
+    
+    return model
+
+
+def empty_cache_if_low(min_free_fraction: float = 0.2):
+    """Return cached CUDA blocks to the driver only when free device memory runs low."""
+    if not torch.cuda.is_available():
+        return
+    
+    free, total = torch.cuda.mem_get_info()
+    if free < min_free_fraction * total:
+        torch.cuda.empty_cache()
+
+
+class _StopForward(Exception):
+    """Raised by a hook to end the forward pass once every target layer has run."""
 
 
 class NeuronActivationHook:
-    """Hook to capture and maximize neuron activations."""
+    """Forward hook that reduces a layer output to one activation per image."""
     
-    def __init__(self, neuron_index: int = None):
+    def __init__(self):
         """
         Initialize the hook.
         
-        Args:
-            neuron_index: Index of the neuron to track. If None, uses mean activation.
+        Nothing is captured until select() picks the rows and neurons to read.
         """
-        self.neuron_index = neuron_index
         self.activation = None
+        
+        # Set by select(): the neurons to reduce the output to inside the hook
+        self.rows = None
+        self.neuron_indices = None
+        self.seq_first = False
+        
+        # Called after each capture; may raise _StopForward to skip the remaining layers
+        self.on_capture = None
     
     def __call__(self, module, input, output):
-        """Capture the activation."""
-        self.activation = output
-    
-    def get_activation_value(self) -> torch.Tensor:
-        """Get the activation value for the target neuron."""
-        if self.activation is None:
-            return torch.tensor(0.0)
+        """Capture the activation, reduced to the selected neurons."""
+        if isinstance(output, tuple):  # nn.MultiheadAttention returns (output, weights)
+            output = output[0]
         
-        activation = self.activation
+        # Picked from the output rank on every call rather than cached on the hook,
+        # so a compiled forward doesn't see the hook's state change and recompile
+        reduce = self._select_reduce(output.dim())
         
-        # Handle different output shapes
-        if len(activation.shape) == 4:  # Conv layer output (B, C, H, W)
-            if self.neuron_index is not None:
-                activation = activation[:, self.neuron_index, :, :]
-            else:
-                activation = activation.mean(dim=1)  # Average over channels
-        elif len(activation.shape) == 2:  # Linear layer output (B, F)
-            if self.neuron_index is not None:
-                activation = activation[:, self.neuron_index]
-            else:
-                activation = activation.mean(dim=1)
+        # Only the per-image values are kept; autograd holds what backward needs
+        self.activation = reduce(output)
         
-        return activation.mean()  # Return mean activation
+        if self.on_capture is not None:
+            self.on_capture()
+    
+    def select(
+        self,
+        rows: torch.Tensor,
+        neuron_indices: torch.Tensor,
+        seq_first: bool = False
+    ):
+        """
+        Reduce the layer output to one activation per image inside the hook.
+        
+        After a forward pass, activation holds a tensor of shape (len(rows),).
+        
+        Args:
+            rows: Indices of the images in the batch
+            neuron_indices: Neuron (channel / feature) to read for each row
+            seq_first: Whether 3-D outputs are laid out as (L, B, D), as in CLIP's transformer
+        """
+        self.rows = rows
+        self.neuron_indices = neuron_indices
+        self.seq_first = seq_first
+        self.activation = None
+    
+    def _select_reduce(self, ndim: int) -> Callable:
+        """Pick the reduction for a layer output of the given rank."""
+        if ndim == 4:
+            return self._reduce_conv
+        elif ndim == 3:
+            return self._reduce_seq_first if self.seq_first else self._reduce_tokens
+        return self._reduce_linear
+    
+    def _reduce_conv(self, output: torch.Tensor) -> torch.Tensor:
+        """Conv layer output (B, C, H, W) -> (K,)."""
+        return output[self.rows, self.neuron_indices].mean(dim=(1, 2))
+    
+    def _reduce_seq_first(self, output: torch.Tensor) -> torch.Tensor:
+        """Token output (L, B, D) -> (K,)."""
+        return output[:, self.rows, self.neuron_indices].mean(dim=0)
+    
+    def _reduce_tokens(self, output: torch.Tensor) -> torch.Tensor:
+        """Token output (B, L, D) -> (K,)."""
+        return output[self.rows, :, self.neuron_indices].mean(dim=1)
+    
+    def _reduce_linear(self, output: torch.Tensor) -> torch.Tensor:
+        """Linear layer output (B, F) -> (K,)."""
+        return output[self.rows, self.neuron_indices]
 
 
 class FeatureVisualizer:
     """Generates images that maximize neuron activations."""
     
-    def __init__(self, model: nn.Module, device: str = "cuda" if torch.cuda.is_available() else "cpu"):
+    def __init__(
+        self,
+        model: nn.Module,
+        device: str = "cuda" if torch.cuda.is_available() else "cpu",
+        compile_visual: bool = False,
+        cuda_graph: bool = False,
+        inspector=None
+    ):
         """
         Initialize the feature visualizer.
         
         Args:
             model: The neural network model
             device: Device to run on (cuda or cpu)
+            compile_visual: Compile the forward pass and loss with torch.compile (CUDA only)
+            cuda_graph: Capture each optimization step as a CUDA graph and replay it
+                (CUDA only; takes precedence over compile_visual, which also uses graphs)
+            inspector: Optional LayerInspector whose layer table is reused for lookups
         """
-        self.model = model.to(device)
+        # Only the visual encoder is used, so leave the text tower where it is
+        model.visual.to(device)
+        self.model = freeze_model(model)
         self.device = device
-        self.model.eval()
+        self.on_cuda = torch.device(device).type == "cuda"
         
-        # Disable gradients for the model
-        for param in self.model.parameters():
-            param.requires_grad = False
+        # NHWC lets the patch-embedding conv use Tensor Core friendly kernels
+        self.memory_format = torch.channels_last if self.on_cuda else torch.contiguous_format
+        self.model.visual.to(memory_format=self.memory_format)
         
-        # Image normalization stats (ImageNet)
-        self.normalize = transforms.Normalize(
-            mean=[0.48145466, 0.4578275, 0.40821073],
-            std=[0.26862954, 0.26130258, 0.27577711]
-        )
+        # Compiled forward/loss functions, specialized per image size and hooked layers
+        self.cuda_graph = cuda_graph and self.on_cuda
+        self.compile_visual = compile_visual and self.on_cuda and not self.cuda_graph
+        self._compiled_forward = None
+        
+        # Captured optimization step, rebuilt whenever its inputs change
+        self._graph = None
+        self._graph_activation = None
+        self._graph_warmup = 0
+        
+        # Activation hooks by layer name, as (hook, handle)
+        self._hooks = {}
+        
+        # Resolved modules by layer name; the inspector has already walked the visual tree
+        if inspector is not None:
+            self._layer_cache = dict(inspector.layers_info)
+        else:
+            self._layer_cache = {
+                f"visual.{name}": module for name, module in self.model.visual.named_modules() if name
+            }
+        
+        # Optimization state, set up by configure() / set_targets() / reset_image()
+        self.targets = []
+        self._target_groups = []
+        self._pending_captures = 0
+        self.params = None
+        self.image = None
+        self._fourier_scale = None
+        self.optimizer = None
+        self.optimizer_name = None
+        self.learning_rate = None
+        self.iteration = 0
+        self.configure()
+        
+        # Normalization as one fused multiply-add: (x - mean) / std == x * scale + shift
+        self._mean = torch.tensor(CLIP_MEAN, device=device).view(1, 3, 1, 1)
+        self._std = torch.tensor(CLIP_STD, device=device).view(1, 3, 1, 1)
+        self._norm_scale = 1.0 / self._std
+        self._norm_shift = -self._mean / self._std
+        
+        # Depthwise (3, 1, 1, K) Gaussian kernel for the periodic blur, built once
+        self._blur_kernel = gaussian_kernel_1d().to(device).view(1, 1, 1, -1).repeat(3, 1, 1, 1)
     
     def generate_image(
         self,
         layer_name: str,
-        neuron_index: int,
+        neuron_index: Union[int, List[int]],
         image_size: int = 224,
         num_iterations: int = 1000,
         learning_rate: float = 0.01,
         blur_every: int = 10,
         seed: int = None,
-        progress_callback: Callable = None
-    ) -> Image.Image:
+        progress_callback: Callable = None,
+        precision: Optional[str] = None,
+        optimizer: str = "adam",
+        parameterization: str = "pixel"
+    ) -> Union[Image.Image, List[Image.Image]]:
         """
         Generate an image that maximally activates a specific neuron.
         
+        Passing a list of neuron indices optimizes one image per neuron in a
+        single batched run; every image starts from the same seed, so each
+        matches what a separate call would produce.
+        
         Args:
             layer_name: Name of the layer (e.g., 'visual.transformer.resblocks.0')
-            neuron_index: Index of the neuron to maximize
+            neuron_index: Index of the neuron to maximize, or a list of indices
             image_size: Size of generated image
             num_iterations: Number of optimization iterations
             learning_rate: Learning rate for optimization
             blur_every: Apply blur every N iterations
             seed: Random seed for reproducibility
             progress_callback: Function to track progress
+            precision: 'fp32', 'fp16' or 'bf16' for the CLIP forward (default: bf16 where supported, else fp16 on GPU)
+            optimizer: 'adam', 'sgd' (momentum 0.9) or 'sgd_nomom' (lowest memory)
+            parameterization: 'pixel', or 'fourier' to optimize a 1/f-scaled spectrum
+                (low-frequency gradients; converges in fewer iterations and skips the blur)
         
         Returns:
-            PIL Image of the generated visualization
+            PIL Image of the generated visualization (a list of them for a list of neurons)
         """
-        if seed is not None:
-            torch.manual_seed(seed)
-            np.random.seed(seed)
+        is_list = isinstance(neuron_index, (list, tuple))
+        neuron_indices = list(neuron_index) if is_list else [neuron_index]
         
-        # Initialize random image
-        image = torch.randn(1, 3, image_size, image_size, device=self.device, requires_grad=True)
+        images = self.generate_images(
+            targets=[(layer_name, index) for index in neuron_indices],
+            image_size=image_size,
+            num_iterations=num_iterations,
+            learning_rate=learning_rate,
+            blur_every=blur_every,
+            seeds=None if seed is None else [seed] * len(neuron_indices),
+            progress_callback=progress_callback,
+            precision=precision,
+            optimizer=optimizer,
+            parameterization=parameterization
+        )
+        return images if is_list else images[0]
+    
+    def generate_images(
+        self,
+        targets: List[Tuple[str, int]],
+        image_size: int = 224,
+        num_iterations: int = 1000,
+        learning_rate: float = 0.01,
+        blur_every: int = 10,
+        seeds: Optional[List[int]] = None,
+        progress_callback: Callable = None,
+        precision: Optional[str] = None,
+        optimizer: str = "adam",
+        parameterization: str = "pixel"
+    ) -> List[Image.Image]:
+        """
+        Generate one image per (layer, neuron) target in a single batched optimization.
         
-        # Create optimizer
-        optimizer = torch.optim.Adam([image], lr=learning_rate)
+        All targets share one forward/backward pass per iteration; each image in
+        the batch only receives gradient from its own target neuron.
         
-        # Register hook to capture activations
-        target_layer = self._get_layer_by_name(layer_name)
-        if target_layer is None:
-            raise ValueError(f"Layer {layer_name} not found")
+        Args:
+            targets: List of (layer_name, neuron_index) pairs
+            image_size: Size of generated images
+            num_iterations: Number of optimization iterations
+            learning_rate: Learning rate for optimization
+            blur_every: Apply blur every N iterations
+            seeds: Optional per-target random seeds for reproducibility
+            progress_callback: Function to track progress (receives the mean activation)
+            precision: 'fp32', 'fp16' or 'bf16' for the CLIP forward (default: bf16 where supported, else fp16 on GPU)
+            optimizer: 'adam', 'sgd' (momentum 0.9) or 'sgd_nomom' (lowest memory)
+            parameterization: 'pixel', or 'fourier' to optimize a 1/f-scaled spectrum
+                (low-frequency gradients; converges in fewer iterations and skips the blur)
         
-        hook = NeuronActivationHook(neuron_index)
-        handle = target_layer.register_forward_hook(hook)
+        Returns:
+            List of PIL Images, in the same order as targets
+        """
+        if not targets:
+            return []
+        
+        self.configure(
+            image_size=image_size,
+            learning_rate=learning_rate,
+            blur_every=blur_every,
+            precision=precision,
+            optimizer=optimizer,
+            parameterization=parameterization
+        )
         
         try:
-            for iteration in range(num_iterations):
-                optimizer.zero_grad()
-                
-                # Normalize image
-                normalized_image = self.normalize(image)
-                
-                # Forward pass through model
-                with torch.no_grad():
-                    _ = self.model.visual(normalized_image)
-                
-                # Get activation value
-                activation = hook.get_activation_value()
-                
-                # Compute loss (negative because we want to maximize)
-                loss = -activation
-                
-                # Backward pass
-                loss.backward()
-                
-                # Apply gradient update
-                optimizer.step()
-                
-                # Apply total variation regularization
-                with torch.no_grad():
-                    tv_loss = self._total_variation(image)
-                    image.data -= 0.01 * tv_loss
-                
-                # Apply periodic blur for smoothness
-                if (iteration + 1) % blur_every == 0:
-                    with torch.no_grad():
-                        image.data = self._apply_blur(image.data)
-                
-                # Clamp values to valid range
-                with torch.no_grad():
-                    image.data.clamp_(-2.0, 2.0)
-                
-                # Progress callback
-                if progress_callback and (iteration + 1) % max(1, num_iterations // 20) == 0:
-                    progress_callback(iteration + 1, num_iterations, float(activation.item()))
+            self.set_targets(targets)
+            self.reset_image(seeds)
+            self.run(num_iterations, progress_callback)
         
         finally:
-            handle.remove()
+            self.clear_targets()
+        
+        return self.get_images()
+    
+    def configure(
+        self,
+        image_size: int = 224,
+        learning_rate: float = 0.01,
+        blur_every: int = 10,
+        precision: Optional[str] = None,
+        optimizer: str = "adam",
+        tv_weight: float = DEFAULT_TV_WEIGHT,
+        parameterization: str = "pixel"
+    ):
+        """
+        Set the optimization parameters used by reset_image() and step().
+        
+        Args:
+            image_size: Size of generated images
+            learning_rate: Learning rate for optimization
+            blur_every: Apply blur every N iterations
+            precision: 'fp32', 'fp16' or 'bf16' for the CLIP forward (default: bf16 where supported, else fp16 on GPU)
+            optimizer: 'adam', 'sgd' (momentum 0.9) or 'sgd_nomom' (lowest memory)
+            tv_weight: Weight of the total variation penalty added to the loss
+            parameterization: 'pixel', or 'fourier' to optimize a 1/f-scaled spectrum
+        """
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"optimizer must be one of {list(OPTIMIZERS)}")
+        if parameterization not in PARAMETERIZATIONS:
+            raise ValueError(f"parameterization must be one of {list(PARAMETERIZATIONS)}")
+        
+        # The optimizer is rebuilt by reset_image() only when its settings change
+        if optimizer != self.optimizer_name or learning_rate != self.learning_rate:
+            self.optimizer = None
+        
+        self.image_size = image_size
+        self.learning_rate = learning_rate
+        self.blur_every = blur_every
+        self.tv_weight = tv_weight
+        self.parameterization = parameterization
+        self.optimizer_name = optimizer
+        self.dtype = self._set_precision(precision)
+        self._reset_graph()
+    
+    def set_target(self, layer_name: str, neuron_index: int):
+        """Optimize a single image towards one neuron."""
+        self.set_targets([(layer_name, neuron_index)])
+    
+    def set_targets(self, targets: List[Tuple[str, int]]):
+        """
+        Select the (layer, neuron) pair each image of the batch maximizes.
+        
+        Hooks on layers that stay targeted are kept, so switching neurons
+        within a layer does not re-hook the model.
+        """
+        hooks = {layer_name: self._hook_layer(layer_name) for layer_name, _ in targets}
+        self._release_hooks(keep=hooks)
         
-        # Convert to PIL Image
+        # Per layer: the batch rows targeting it and their neurons, as index tensors
+        self.targets = list(targets)
+        self._target_groups = []
+        for layer_name, hook in hooks.items():
+            rows = [row for row, (name, _) in enumerate(targets) if name == layer_name]
+            group = (
+                hook,
+                torch.tensor(rows, device=self.device),
+                torch.tensor([targets[row][1] for row in rows], device=self.device),
+                # CLIP's transformer (and everything inside it) is laid out (L, B, D)
+                layer_name == "visual.transformer" or layer_name.startswith("visual.transformer."),
+            )
+            hook.select(*group[1:])
+            hook.on_capture = self._count_capture
+            self._target_groups.append(group)
+        self._reset_graph()
+    
+    def suggest_batch_size(
+        self,
+        layer_name: str,
+        max_batch_size: int = 64,
+        memory_fraction: float = 0.8
+    ) -> int:
+        """
+        Estimate how many images of the configured size fit in one batch.
+        
+        Runs a single probe step on one image and scales its peak memory
+        to the free device memory. Without CUDA, returns a fixed default.
+        
+        Args:
+            layer_name: Layer that will be targeted (deeper layers use more memory)
+            max_batch_size: Upper bound on the suggestion
+            memory_fraction: Share of free memory the batch may use
+        """
+        if not self.on_cuda:
+            return DEFAULT_CPU_BATCH_SIZE
+        
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        
+        self.set_target(layer_name, 0)
+        self.reset_image()
+        self.step()
+        torch.cuda.synchronize()
+        
+        per_image = max(torch.cuda.max_memory_allocated() - baseline, 1)
+        free, _ = torch.cuda.mem_get_info()
+        return max(1, min(max_batch_size, int(free * memory_fraction // per_image)))
+    
+    def clear_targets(self):
+        """Remove the activation hooks installed by set_targets()."""
+        self._release_hooks()
+        self.targets = []
+        self._target_groups = []
+    
+    def reset_image(self, seeds: Optional[List[int]] = None):
+        """
+        Re-initialize the image batch with fresh noise and restart the optimizer.
+        
+        The image (or spectrum) tensor and optimizer state are reused in place
+        when the batch shape is unchanged.
+        
+        Args:
+            seeds: Optional per-target random seeds (a single int is accepted for one target)
+        """
+        if isinstance(seeds, int):
+            seeds = [seeds]
+        
+        batch_size = len(self.targets)
+        if seeds is not None and len(seeds) != batch_size:
+            raise ValueError("seeds must have one entry per target")
+        
+        size = self.image_size
+        if self.parameterization == "fourier":
+            # Real and imaginary parts of the rfft2 coefficients
+            shape = (batch_size, 3, size, size // 2 + 1, 2)
+        else:
+            shape = (batch_size, 3, size, size)
+        
+        if self.params is None or self.params.shape != shape:
+            if self.parameterization == "fourier":
+                self.params = torch.empty(shape, device=self.device, requires_grad=True)
+                self._fourier_scale = fourier_scale(size, size).to(self.device)[..., None]
+                self.image = None
+            else:
+                self.params = torch.empty(
+                    shape, device=self.device, memory_format=self.memory_format, requires_grad=True
+                )
+                self.image = self.params
+            self.optimizer = None
+            self._reset_graph()
+        
+        # Fill with noise, one generator per image so results don't depend on batching
+        std = FOURIER_INIT_STD if self.parameterization == "fourier" else 1.0
+        with torch.no_grad():
+            if seeds is None:
+                self.params.normal_(std=std)
+            else:
+                for row, seed in enumerate(seeds):
+                    generator = torch.Generator(device=self.device).manual_seed(seed)
+                    self.params[row].normal_(std=std, generator=generator)
+        
+        # Optimizer state, zeroed in place (equivalent to a fresh optimizer)
+        if self.optimizer is None:
+            self.optimizer = self._make_optimizer(self.params, self.optimizer_name, self.learning_rate)
+            self._reset_graph()
+        else:
+            for state in self.optimizer.state.values():
+                for value in state.values():
+                    if torch.is_tensor(value):
+                        value.zero_()
+        
+        self.iteration = 0
+    
+    def run(self, num_iterations: int, progress_callback: Callable = None, min_interval: float = 0.05):
+        """
+        Run several optimization steps on the current image batch.
+        
+        Activations stay on the device; the host only waits for the GPU when
+        a progress update is actually delivered, at most every min_interval
+        seconds (the final update is always delivered).
+        
+        Args:
+            num_iterations: Number of optimization iterations
+            progress_callback: Function to track progress (receives the mean activation)
+            min_interval: Minimum time in seconds between progress updates
+        """
+        if not progress_callback:
+            for _ in range(num_iterations):
+                self._step()
+            return
+        
+        # Iterations that may report, fixed up front (about 20 per run plus the last)
+        report_every = max(1, num_iterations // 20)
+        report_steps = set(range(report_every, num_iterations + 1, report_every))
+        report_steps.add(num_iterations)
+        last_report = float("-inf")
+        
+        for iteration in range(1, num_iterations + 1):
+            activation = self._step()
+            
+            if iteration not in report_steps:
+                continue
+            
+            # Only reported activations are copied to the host (a device sync)
+            now = time.monotonic()
+            if iteration == num_iterations or now - last_report >= min_interval:
+                last_report = now
+                progress_callback(iteration, num_iterations, activation.item() / len(self.targets))
+    
+    def step(self) -> torch.Tensor:
+        """
+        Run one optimization iteration on the current image batch.
+        
+        Returns:
+            Sum of the target activations before the update (detached)
+        """
+        activation = self._step()
+        
+        # The captured graph's output is overwritten by the next replay, so hand out a copy
+        return activation.clone() if self.cuda_graph else activation
+    
+    def _step(self) -> torch.Tensor:
+        """
+        Run one optimization iteration without copying the activation.
+        
+        With CUDA graphs the returned tensor is the graph's static output
+        buffer, overwritten by the next replay; read it before stepping again.
+        """
+        if self.cuda_graph:
+            activation = self._graph_step()
+        else:
+            activation = self._optimization_step()
+        
+        self.iteration += 1
+        if self.iteration % self.blur_every == 0:
+            self._housekeeping()
+        
+        return activation
+    
+    @torch.no_grad()
+    def _housekeeping(self):
+        """
+        Periodic regularization, run every blur_every iterations outside any captured graph.
+        
+        The per-step clamp lives in _update(); this only blurs pixel images in
+        place (a 1/f spectrum already keeps high frequencies down).
+        """
+        if self.parameterization == "pixel":
+            self.image.copy_(self._apply_blur(self.image))
+    
+    def _optimization_step(self) -> torch.Tensor:
+        """Forward, backward and update for one iteration."""
+        params = self.params
+        forward_loss = self._get_forward_loss(self.image_size)
+        
+        # Drop the gradient rather than memset it; backward writes a fresh one
+        self.optimizer.zero_grad(set_to_none=True)
+        
+        # The whole graph has to be recorded, even if the caller disabled grad;
+        # the frozen parameters mean autograd only tracks the path back to the image
+        with torch.inference_mode(False), torch.enable_grad():
+            loss, activation = forward_loss(self._render())
+        
+        # Backward pass
+        loss.backward()
+        
+        if params.grad is None:
+            raise RuntimeError("Activation gradient did not reach the image; check the forward pass is not run under no_grad")
+        
+        # Apply gradient update and clamp
+        self._update()
+        
+        # Copy out, as compiled graphs may reuse the output buffer on the next step
+        return activation.detach().clone() if self.compile_visual else activation.detach()
+    
+    @torch.no_grad()
+    def _update(self):
+        """Optimizer step followed by the clamp to the valid pixel range."""
+        self.optimizer.step()
+        
+        if self.parameterization == "pixel":
+            self.params.clamp_(-PIXEL_RANGE, PIXEL_RANGE)
+    
+    def _render(self) -> torch.Tensor:
+        """Image batch (B, 3, H, W) described by the optimized parameters."""
+        if self.parameterization == "pixel":
+            return self.params
+        
+        spectrum = torch.view_as_complex(self.params * self._fourier_scale)
+        image = torch.fft.irfft2(spectrum, s=(self.image_size, self.image_size)) / 4
+        return image.contiguous(memory_format=self.memory_format)
+    
+    def _forward_loss(self, image: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Normalize, run the visual encoder and build the loss.
+        
+        Returns:
+            Tuple of (loss, summed target activation)
+        """
+        normalized_image = self.normalize(image)
+        
+        # Layers after the last targeted one don't affect the loss, so the
+        # forward is cut short as soon as every target hook has captured
+        self._pending_captures = len(self._target_groups)
+        with self._autocast(self.dtype):
+            try:
+                _ = self.model.visual(normalized_image)
+            except _StopForward:
+                pass
+        
+        # Some modules are registered but never called, e.g. the out_proj of
+        # nn.MultiheadAttention, whose weights are used functionally
+        for layer_name, (hook, _) in self._hooks.items():
+            if hook.activation is None:
+                raise ValueError(
+                    f"Layer '{layer_name}' did not run during the forward pass, "
+                    f"so it has no activation to maximize"
+                )
+        
+        # Sum of each image's own target activation, already gathered by the hooks
+        activation = sum(hook.activation.float().sum() for hook, _, _, _ in self._target_groups)
+        
+        # Compute loss (negative because we want to maximize), with the
+        # smoothness penalty folded in so the optimizer sees one gradient
+        loss = -activation + self.tv_weight * self._total_variation(image)
+        return loss, activation
+    
+    def _graph_step(self) -> torch.Tensor:
+        """Run one iteration by replaying the captured CUDA graph."""
+        if self._graph is None:
+            # Warm up on a side stream so cuBLAS/cuDNN settle on their kernels
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                activation = self._optimization_step()
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            self._graph_warmup += 1
+            if self._graph_warmup < CUDA_GRAPH_WARMUP_STEPS:
+                return activation
+            
+            # Capture with no grads allocated so backward owns the grad buffer
+            self.optimizer.zero_grad(set_to_none=True)
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                self._graph_activation = self._optimization_step()
+            self._graph = graph
+            return activation
+        
+        self._graph.replay()
+        return self._graph_activation
+    
+    def _reset_graph(self):
+        """Drop the captured graph so the next step re-captures it."""
+        self._graph = None
+        self._graph_activation = None
+        self._graph_warmup = 0
+    
+    def get_images(self) -> List[Image.Image]:
+        """Convert the current image batch to PIL Images."""
         with torch.no_grad():
-            img_np = self._tensor_to_image(image.detach())
+            return [Image.fromarray(array) for array in self._tensor_to_image(self._render().detach())]
+    
+    def _make_optimizer(self, image: torch.Tensor, name: str, learning_rate: float) -> torch.optim.Optimizer:
+        """Create the optimizer for the image (or spectrum) parameters."""
+        if name == "adam":
+            # The fused kernel updates m, v and the image in one launch and keeps the
+            # step counter on the device; graph replay additionally needs capturable
+            return torch.optim.Adam(
+                [image], lr=learning_rate, capturable=self.cuda_graph, fused=self.on_cuda or None
+            )
+        elif name in ("sgd", "sgd_nomom"):
+            # SGD needs a larger step than Adam to move the image as far
+            momentum = 0.0 if name == "sgd_nomom" else 0.9
+            return torch.optim.SGD([image], lr=learning_rate * 10, momentum=momentum)
         
-        return Image.fromarray(img_np)
+        raise ValueError(f"optimizer must be one of {list(OPTIMIZERS)}")
+    
+    def _set_precision(self, precision: Optional[str]) -> torch.dtype:
+        """Cast the visual encoder to the requested precision and return its dtype."""
+        if precision is None:
+            precision = default_precision(self.device)
+        
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {list(PRECISIONS)}")
+        
+        dtype = PRECISIONS[precision] if self.on_cuda else torch.float32
+        if self.model.visual.conv1.weight.dtype != dtype:
+            self.model.visual.to(dtype)
+        
+        return dtype
+    
+    def _hook_layer(self, layer_name: str) -> NeuronActivationHook:
+        """Attach an activation hook to a layer, reusing one already attached."""
+        if layer_name not in self._hooks:
+            target_layer = self._get_layer_by_name(layer_name)
+            if target_layer is None:
+                raise ValueError(f"Layer {layer_name} not found")
+            
+            hook = NeuronActivationHook()
+            self._hooks[layer_name] = (hook, target_layer.register_forward_hook(hook))
+        
+        return self._hooks[layer_name][0]
+    
+    def _release_hooks(self, keep: Dict[str, NeuronActivationHook] = None):
+        """Detach activation hooks, except those for the layers in keep."""
+        keep = keep or {}
+        for layer_name in [name for name in self._hooks if name not in keep]:
+            hook, handle = self._hooks.pop(layer_name)
+            hook.on_capture = None
+            handle.remove()
+    
+    def _count_capture(self):
+        """Stop the forward pass once the last target hook has captured."""
+        self._pending_captures -= 1
+        if self._pending_captures == 0:
+            raise _StopForward
+    
+    def _get_forward_loss(self, image_size: int) -> Callable:
+        """
+        Get the forward/loss function to run, compiled if enabled.
+        
+        Compiling normalization, the encoder, the activation gather and the TV
+        penalty together lets Inductor fuse the small elementwise kernels around
+        the encoder instead of launching each one separately.
+        
+        There is one compiled function. Batch and image sizes are dynamic, so
+        only the set of hooked layers selects a graph: each distinct set is
+        compiled once (the early exit makes them genuinely different graphs),
+        and Dynamo's recompile limit is raised to cover every layer.
+        """
+        if not self.compile_visual:
+            return self._forward_loss
+        
+        if self._compiled_forward is None:
+            limit = len(self._layer_cache) + COMPILE_RECOMPILE_MARGIN
+            config = torch._dynamo.config
+            
+            # Named *_cache_size_limit before PyTorch 2.6
+            for name in ("recompile_limit", "accumulated_recompile_limit",
+                         "cache_size_limit", "accumulated_cache_size_limit"):
+                if hasattr(config, name):
+                    setattr(config, name, max(getattr(config, name), limit))
+            self._compiled_forward = torch.compile(
+                self._forward_loss, mode="reduce-overhead", fullgraph=False, dynamic=True
+            )
+        
+        return self._compiled_forward
+    
+    def _autocast(self, dtype: torch.dtype):
+        """Autocast context for the forward pass (no-op for FP32)."""
+        if dtype == torch.float32:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type="cuda", dtype=dtype, cache_enabled=False)
+    
+    def normalize(self, image: torch.Tensor) -> torch.Tensor:
+        """Apply CLIP's input normalization to an image batch."""
+        return torch.addcmul(self._norm_shift, image, self._norm_scale)
     
     def _get_layer_by_name(self, layer_name: str) -> nn.Module:
         """Get a layer by its name."""
+        if layer_name in self._layer_cache:
+            return self._layer_cache[layer_name]
+        
+        # Names outside the visual tree (or the model itself) are walked once and memoized
         parts = layer_name.split('.')
         module = self.model
         
@@ -182,40 +875,43 @@ class FeatureVisualizer:
             else:
                 return None
         
+        self._layer_cache[layer_name] = module
         return module
     
     def _total_variation(self, image: torch.Tensor) -> torch.Tensor:
-        """Compute total variation loss."""
-        diff1 = image[:, :, :, :-1] - image[:, :, :, 1:]
-        diff2 = image[:, :, :-1, :] - image[:, :, 1:, :]
+        """Compute total variation loss, summed over the images of the batch."""
+        # Horizontal and vertical differences from the same strided view, accumulated
+        # in place into one buffer and reduced once (Inductor fuses this into one kernel)
+        corner = image[:, :, :-1, :-1]
+        tv = (corner - image[:, :, :-1, 1:]).abs_()
+        tv.add_((corner - image[:, :, 1:, :-1]).abs_())
         
-        tv = torch.mean(torch.abs(diff1)) + torch.mean(torch.abs(diff2))
-        return tv
+        # Per-image means, so each image is penalized the same regardless of batch size
+        return tv.mean(dim=(1, 2, 3)).sum()
     
-    def _apply_blur(self, image: torch.Tensor, kernel_size: int = 3) -> torch.Tensor:
-        """Apply Gaussian blur to image."""
-        if kernel_size % 2 == 0:
-            kernel_size += 1
+    def _apply_blur(self, image: torch.Tensor) -> torch.Tensor:
+        """Apply Gaussian blur to image as two separable depthwise convolutions."""
+        kernel = self._blur_kernel
+        padding = kernel.shape[-1] // 2
         
-        padding = kernel_size // 2
-        blurred = F.avg_pool2d(image, kernel_size=kernel_size, stride=1, padding=padding)
-        return blurred
+        # Reflect the borders so edge pixels aren't pulled towards zero (the mean color)
+        padded = F.pad(image, (padding, padding, padding, padding), mode="reflect")
+        blurred = F.conv2d(padded, kernel, groups=3)
+        return F.conv2d(blurred, kernel.transpose(2, 3), groups=3)
     
     def _tensor_to_image(self, image_tensor: torch.Tensor) -> np.ndarray:
-        """Convert tensor to numpy image array."""
-        # Denormalize using ImageNet stats
-        image_tensor = image_tensor.cpu().squeeze(0).permute(1, 2, 0)
-        
-        # Manual denormalization
-        mean = torch.tensor([0.48145466, 0.4578275, 0.40821073])
-        std = torch.tensor([0.26862954, 0.26130258, 0.27577711])
-        
-        image_tensor = image_tensor * std + mean
+        """
+        Convert a normalized image batch to uint8 pixels.
         
-        # Clamp to [0, 1]
-        image_tensor = torch.clamp(image_tensor, 0, 1)
+        Args:
+            image_tensor: Tensor of shape (B, 3, H, W)
         
-        # Convert to uint8
-        image_array = (image_tensor.numpy() * 255).astype(np.uint8)
+        Returns:
+            Array of shape (B, H, W, 3)
+        """
+        # Denormalize, clamp and quantize on the device, so only bytes are copied to the host
+        pixels = torch.addcmul(self._mean, image_tensor, self._std).clamp_(0, 1).mul_(255)
+        pixels = pixels.to(torch.uint8).permute(0, 2, 3, 1)
         
-        return image_array
+        # Channels-last images are already HWC in memory, so this copy is a no-op there
+        return pixels.contiguous().cpu().numpy()
@@ -0,0 +1,55 @@
+"""
+Image encoding helpers for serving generated visualizations.
+"""
+
+import io
+
+from PIL import Image
+
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "raw": "application/octet-stream",
+}
+
+
+def _raw_bytes(image: Image.Image) -> bytes:
+    """Dump the pixel buffer with a single call to Pillow's raw encoder."""
+    image.load()
+    encoder = Image._getencoder(image.mode, "raw", image.mode)
+    encoder.setimage(image.im, (0, 0) + image.size)
+
+    # Size the buffer for the whole image so Pillow never loops over MAXBLOCK chunks
+    bufsize = max(image.width * image.height * len(image.getbands()), image.width * 4)
+    _, status, data = encoder.encode(bufsize)
+
+    if status < 0:
+        raise ValueError(f"Raw encoder failed with status {status}")
+    if status == 0:
+        # Encoder needs more passes (unusual modes), use the chunked path
+        return image.tobytes()
+
+    return data
+
+
+def encode_image_fast(image: Image.Image, fmt: str = "png", level: int = 6) -> bytes:
+    """
+    Encode a PIL image to bytes for serving or caching.
+
+    Args:
+        image: PIL Image to encode
+        fmt: Output format, either 'png' or 'raw' (packed pixel buffer)
+        level: Deflate compression level for PNG output
+
+    Returns:
+        Encoded image bytes
+    """
+    if fmt == "raw":
+        return _raw_bytes(image)
+
+    if fmt != "png":
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {list(MEDIA_TYPES)}")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=level)
+    return buffer.getvalue()
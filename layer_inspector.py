@@ -2,12 +2,22 @@
 Module for inspecting CLIP model layers and neurons.
 """
 
-import torch
 import torch.nn as nn
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import clip
 
 
+# Substrings identifying the layers worth visualizing
+INTERESTING_LAYER_TAGS = ('transformer', 'attn', 'mlp', 'ln', 'proj')
+
+
+@lru_cache(maxsize=None)
+def _unit_names(prefix: str, count: int) -> Tuple[str, ...]:
+    """Names prefix_0 ... prefix_{count-1}, built once per (prefix, count)."""
+    return tuple(f"{prefix}_{i}" for i in range(count))
+
+
 class LayerInspector:
     """Inspects and provides information about CLIP model layers."""
     
@@ -22,14 +32,22 @@ class LayerInspector:
         self.model = model
         self.model_name = model_name
         self.layers_info = self._extract_layers()
+        self._output_shapes = {}
     
     def _extract_layers(self) -> Dict[str, nn.Module]:
         """Extract all named layers from the model."""
         layers = {}
         
+        # nn.MultiheadAttention uses its submodules' weights functionally and
+        # never calls them, so hooks on e.g. attn.out_proj would never fire
+        attention_prefixes = tuple(
+            f"{name}." for name, module in self.model.visual.named_modules()
+            if isinstance(module, nn.MultiheadAttention)
+        )
+        
         # Get visual encoder layers
         for name, module in self.model.visual.named_modules():
-            if name and not name.startswith('_'):
+            if name and not name.startswith('_') and not name.startswith(attention_prefixes):
                 layers[f"visual.{name}"] = module
         
         return layers
@@ -38,6 +56,16 @@ class LayerInspector:
         """Get all available layer names."""
         return sorted(list(self.layers_info.keys()))
     
+    def get_interesting_layer_names(self) -> List[str]:
+        """Get layer names worth visualizing, falling back to all layers."""
+        layer_names = self.get_layer_names()
+        interesting_layers = [
+            l for l in layer_names
+            if any(tag in l for tag in INTERESTING_LAYER_TAGS)
+        ]
+        
+        return interesting_layers or layer_names
+    
     def get_layer(self, layer_name: str) -> nn.Module:
         """Get a specific layer by name."""
         return self.layers_info.get(layer_name)
@@ -62,10 +90,14 @@ class LayerInspector:
         
         return info
     
-    def get_neuron_names(self, layer_name: str) -> List[str]:
+    def get_neuron_names(self, layer_name: str, max_units: Optional[int] = None) -> List[str]:
         """
         Get neuron names for a given layer.
         Returns semantic names based on common patterns.
+        
+        Args:
+            layer_name: Name of the layer
+            max_units: Optional cap on the number of names for non-linear, non-conv layers
         """
         layer = self.get_layer(layer_name)
         if layer is None:
@@ -82,39 +114,44 @@ class LayerInspector:
             return []
         
         # Generate semantic names based on layer type and position
-        names = []
-        layer_type = type(layer).__name__
-        
         if isinstance(layer, nn.Linear):
-            for i in range(num_neurons):
-                # Create meaningful names for linear layers
-                names.append(f"neuron_{i}")
+            return list(_unit_names("neuron", num_neurons))
         elif isinstance(layer, nn.Conv2d):
             channels = layer.out_channels if hasattr(layer, 'out_channels') else num_neurons
-            for i in range(channels):
-                names.append(f"channel_{i}")
-        else:
-            for i in range(min(num_neurons, 768)):  # Limit to reasonable number
-                names.append(f"unit_{i}")
+            return list(_unit_names("channel", channels))
         
-        return names
+        if max_units is not None:
+            num_neurons = min(num_neurons, max_units)
+        return list(_unit_names("unit", num_neurons))
     
     def get_layer_output_shape(self, layer_name: str, input_shape: Tuple) -> Tuple:
         """
         Estimate the output shape of a layer given an input shape.
+        
+        Computed from the layer's attributes alone, without running the layer,
+        and memoized per (layer_name, input_shape).
         """
+        key = (layer_name, tuple(input_shape))
+        if key not in self._output_shapes:
+            self._output_shapes[key] = self._compute_output_shape(layer_name, tuple(input_shape))
+        return self._output_shapes[key]
+    
+    def _compute_output_shape(self, layer_name: str, input_shape: Tuple) -> Tuple:
+        """Output shape of a Linear or Conv2d layer, None for other layers."""
         layer = self.get_layer(layer_name)
         if layer is None:
             return None
         
-        try:
-            with torch.no_grad():
-                dummy_input = torch.randn(input_shape)
-                if hasattr(layer, 'out_features'):
-                    return (input_shape[0], layer.out_features)
-                elif isinstance(layer, nn.Conv2d):
-                    return (input_shape[0], layer.out_channels, input_shape[2], input_shape[3])
-        except:
-            pass
+        if hasattr(layer, 'out_features'):
+            return (input_shape[0], layer.out_features)
+        elif isinstance(layer, nn.Conv2d) and len(input_shape) == 4 and not isinstance(layer.padding, str):
+            # Standard convolution arithmetic, per spatial dimension
+            spatial = tuple(
+                (size + 2 * pad - dilation * (kernel - 1) - 1) // stride + 1
+                for size, pad, dilation, kernel, stride in zip(
+                    input_shape[2:], layer.padding, layer.dilation, layer.kernel_size, layer.stride
+                )
+            )
+            return (input_shape[0], layer.out_channels) + spatial
         
         return None
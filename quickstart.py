@@ -52,7 +52,8 @@ def quick_start_example():
     
     # Initialize visualizer
     print("\n🎨 Initializing feature visualizer...")
-    visualizer = FeatureVisualizer(model, device=device)
+    # Every iteration runs the same fixed-shape step, so replay it as a CUDA graph
+    visualizer = FeatureVisualizer(model, device=device, cuda_graph=device == "cuda", inspector=inspector)
     print("✓ Visualizer ready!")
     
     # Generate visualization
@@ -0,0 +1,172 @@
+"""
+Disk-backed LRU cache for generated visualizations.
+
+Generation is a pure function of its parameters (the seed is one of them),
+so finished images can be stored on disk and served again without rerunning
+the optimization. Shared by the API server and the Streamlit app.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+
+DEFAULT_CACHE_DIR = os.getenv("CLIP_CACHE_DIR", ".cache/visualizations")
+DEFAULT_MAX_ENTRIES = int(os.getenv("CLIP_CACHE_MAX_ENTRIES", "2000"))
+
+# Part of every key; bump it whenever generation or encoding changes its output
+CACHE_VERSION = 1
+
+
+class ResultCache:
+    """Stores encoded images on disk, evicting the least recently used."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding the cached files
+            max_entries: Maximum number of files kept before evicting
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        """
+        Hash generation parameters into a cache key.
+
+        CACHE_VERSION is mixed in, so entries written by older code are
+        never served after the output format changes.
+
+        Args:
+            params: JSON-serializable parameters that fully determine the output
+
+        Returns:
+            Hex SHA1 digest of the parameters
+        """
+        versioned = {**params, "cache_version": CACHE_VERSION}
+        return hashlib.sha1(json.dumps(versioned, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key: str, extension: str = "png") -> Path:
+        """Location of the cache file for a key."""
+        return self.cache_dir / f"{key}.{extension}"
+
+    def get(self, key: str, extension: str = "png") -> Optional[bytes]:
+        """
+        Read a cached file.
+
+        The bytes are read here rather than handing out the path, so an
+        entry evicted by another process between lookup and read is just
+        a miss.
+
+        Args:
+            key: Cache key from make_key
+            extension: File extension of the cached format
+
+        Returns:
+            Cached bytes, or None on a miss
+        """
+        path = self.path(key, extension)
+        try:
+            # Bump the mtime so eviction sees this entry as recently used
+            os.utime(path)
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes, extension: str = "png") -> Path:
+        """
+        Store encoded bytes under a key.
+
+        The file is written to a temporary name and renamed into place, so
+        concurrent readers never see a partial image.
+
+        Args:
+            key: Cache key from make_key
+            data: Encoded image bytes
+            extension: File extension of the cached format
+
+        Returns:
+            Path to the cached file
+        """
+        path = self.path(key, extension)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+        self._evict()
+        return path
+
+    def _evict(self):
+        """Delete the least recently used files beyond max_entries."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def generation_key(
+    *,
+    layer_name: str,
+    neuron_index: int,
+    image_size: int,
+    num_iterations: int,
+    learning_rate: float,
+    blur_every: int,
+    seed: int,
+    precision: str,
+    optimizer: str,
+    parameterization: str,
+    format: str,
+    model: str,
+    device: str
+) -> str:
+    """
+    Cache key for one generated image, shared by /api/generate and the app.
+
+    Every setting is a required keyword, so a generation field added on one
+    side but not here fails loudly instead of silently splitting the cache.
+
+    Args:
+        layer_name, neuron_index, ..., format: Fields of the API's GenParams,
+            with precision already resolved to a concrete value
+        model: CLIP model name
+        device: Device the image is generated on
+
+    Returns:
+        Hex SHA1 cache key
+    """
+    return ResultCache.make_key({
+        "layer_name": layer_name,
+        "neuron_index": neuron_index,
+        "image_size": image_size,
+        "num_iterations": num_iterations,
+        "learning_rate": learning_rate,
+        "blur_every": blur_every,
+        "seed": seed,
+        # CPU always runs FP32, whatever was requested
+        "precision": precision if device == "cuda" else "fp32",
+        "optimizer": optimizer,
+        "parameterization": parameterization,
+        "format": format,
+        "model": model,
+        "device": device,
+    })
@@ -225,10 +225,10 @@ export default function Home() {
                   </label>
                   <input
                     type="range"
-                    min="64"
-                    max="512"
-                    step="32"
+                    min="224"
+                    max="224"
                     value={imageSize}
+                    disabled
                     onChange={(e) => setImageSize(parseInt(e.target.value))}
                     className="w-full"
                   />